@@ -48,6 +48,8 @@ from .shorten_dataset import TruncateDataset, RandomCropDataset
 
 from .contrastive_dataset import ContrastiveDataset
 from .sentence_replace_dataset import SentenceReplaceDataset
+from .multilingual_concat_dataset import MultilingualConcatDataset
+from .fused_src_append_dataset import FusedSrcAppendDataset
 
 from .iterators import (
     CountingIterator,
@@ -108,5 +110,7 @@ __all__ = [
     'TruncateDataset',
     'TruncatedDictionary',
     'ContrastiveDataset',
-    'SentenceReplaceDataset'
+    'SentenceReplaceDataset',
+    'MultilingualConcatDataset',
+    'FusedSrcAppendDataset',
 ]
@@ -0,0 +1,53 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import numpy as np
+import torch
+from fairseq.data import (
+    AppendTokenDataset,
+    FusedSrcAppendDataset,
+    ListDataset,
+    StripTokenDataset,
+    TruncateDataset,
+)
+
+
+class TestFusedSrcAppendDataset(unittest.TestCase):
+    def setUp(self):
+        self.eos = 2
+        items = [
+            torch.LongTensor([5, 6, 7, 8, 9, 2]),
+            torch.LongTensor([2, 5, 6, 2, 2]),
+            torch.LongTensor([5, 2]),
+            torch.LongTensor([2]),
+        ]
+        self.dataset = ListDataset(items, np.array([len(x) for x in items]))
+
+    def _reference(self, trunc_len, lang_tok):
+        ds = AppendTokenDataset(
+            TruncateDataset(
+                StripTokenDataset(self.dataset, self.eos),
+                trunc_len - 1,
+            ),
+            self.eos,
+        )
+        return AppendTokenDataset(ds, lang_tok)
+
+    def test_matches_nested_wrappers(self):
+        for trunc_len in (2, 4, 10):
+            for lang_tok in (None, 250004):
+                ref = self._reference(trunc_len, lang_tok)
+                fused = FusedSrcAppendDataset(
+                    self.dataset, self.eos, lang_tok=lang_tok, trunc_len=trunc_len,
+                )
+                for i in range(len(self.dataset)):
+                    self.assertEqual(fused[i].tolist(), ref[i].tolist())
+                self.assertEqual(fused.sizes.tolist(), ref.sizes.tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
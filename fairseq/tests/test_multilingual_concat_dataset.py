@@ -0,0 +1,58 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import numpy as np
+import torch
+from fairseq.data import LanguagePairDataset, TokenBlockDataset
+from fairseq.data.concat_dataset import ConcatDataset
+from fairseq.data.multilingual_concat_dataset import MultilingualConcatDataset
+from tests.test_train import mock_dict
+
+
+class TestMultilingualConcatDataset(unittest.TestCase):
+    def _make_dataset(self, tokens):
+        tokens = torch.LongTensor(tokens).view(len(tokens), -1)
+        tokens_ds = TokenBlockDataset(
+            tokens,
+            sizes=[tokens.size(-1)] * tokens.size(0),
+            block_size=1,
+            pad=0,
+            eos=1,
+            include_targets=False,
+        )
+        return LanguagePairDataset(
+            tokens_ds, tokens_ds.sizes, mock_dict(), shuffle=False
+        )
+
+    def setUp(self):
+        self.dataset_1 = self._make_dataset([1])
+        self.dataset_2 = self._make_dataset([2, 3])
+
+    def test_matches_concat_dataset(self):
+        for ratios in ([1, 1], [1, 2], [2, 1]):
+            ref = ConcatDataset([self.dataset_1, self.dataset_2], sample_ratios=ratios)
+            d = MultilingualConcatDataset([self.dataset_1, self.dataset_2], sample_ratios=ratios)
+            assert(len(d) == len(ref))
+            for i in range(len(d)):
+                assert(d[i]['source'][0] == ref[i]['source'][0])
+            assert(np.array_equal(d.sizes, ref.sizes))
+            assert(d.sizes.dtype == np.int32)
+
+    def test_size_and_num_tokens(self):
+        for ratios in ([1, 1], [1, 2], [2, 1]):
+            ref = ConcatDataset([self.dataset_1, self.dataset_2], sample_ratios=ratios)
+            d = MultilingualConcatDataset([self.dataset_1, self.dataset_2], sample_ratios=ratios)
+            for i in range(len(d)):
+                assert(tuple(d.size(i)) == tuple(ref.size(i)))
+                assert(d.num_tokens(i) == ref.num_tokens(i))
+
+    def test_array_index_lookup(self):
+        d = MultilingualConcatDataset([self.dataset_1, self.dataset_2])
+        assert(d._get_dataset_and_sample_index(2) == (1, 1))
+        dataset_idx, sample_idx = d._get_dataset_and_sample_index(np.arange(3))
+        assert(dataset_idx.tolist() == [0, 1, 1])
+        assert(sample_idx.tolist() == [0, 0, 1])
@@ -0,0 +1,59 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+import torch
+
+from . import BaseWrapperDataset
+
+
+class FusedSrcAppendDataset(BaseWrapperDataset):
+    """
+    Strip *eos* from both ends of each example, truncate it to
+    ``trunc_len - 1`` tokens and append *eos* followed by an optional
+    language token, all in a single ``torch.cat``.
+
+    Equivalent to
+    ``AppendTokenDataset(AppendTokenDataset(TruncateDataset(StripTokenDataset(
+    dataset, eos), trunc_len - 1), eos), lang_tok)`` without the per-layer
+    indexing and intermediate tensors.
+
+    Args:
+        dataset (~fairseq.data.FairseqDataset): dataset to wrap
+        eos (int): end-of-sentence index
+        lang_tok (int, optional): token appended after *eos*
+        trunc_len (int): maximum length before the appended *eos*, plus one
+    """
+
+    def __init__(self, dataset, eos, lang_tok=None, trunc_len=None):
+        super().__init__(dataset)
+        assert trunc_len is not None
+        self.eos = eos
+        self.lang_tok = lang_tok
+        self.trunc_len = trunc_len
+        tail = [eos] if lang_tok is None else [eos, lang_tok]
+        self._tail = torch.LongTensor(tail)
+        self._sizes = np.minimum(np.array(dataset.sizes), trunc_len - 1) + len(tail)
+
+    def __getitem__(self, index):
+        item = self.dataset[index]
+        end = len(item)
+        while end > 0 and item[end - 1] == self.eos:
+            end -= 1
+        start = 0
+        while start < end and item[start] == self.eos:
+            start += 1
+        end = min(end, start + self.trunc_len - 1)
+        return torch.cat([item[start:end], self._tail])
+
+    @property
+    def sizes(self):
+        return self._sizes
+
+    def num_tokens(self, index):
+        return self._sizes[index]
+
+    def size(self, index):
+        return self._sizes[index]
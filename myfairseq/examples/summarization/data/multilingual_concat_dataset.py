@@ -0,0 +1,73 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+
+from .concat_dataset import ConcatDataset
+
+
+class MultilingualConcatDataset(ConcatDataset):
+    """
+    A ConcatDataset over per-language datasets that precomputes the
+    concatenated sizes once as contiguous int32 arrays, so ``sizes``,
+    ``size`` and ``num_tokens`` are plain array reads.
+
+    Single indices are located with the inherited ``bisect`` lookup;
+    ``_get_dataset_and_sample_index`` also accepts an array of indices and
+    resolves it with one ``np.searchsorted``, as a helper for batch lookups.
+
+    Args:
+        datasets (List[~fairseq.data.FairseqDataset]): one dataset per language
+        sample_ratios (int or List[int], optional): upsampling ratio per dataset
+    """
+
+    def __init__(self, datasets, sample_ratios=1):
+        super().__init__(datasets, sample_ratios)
+        self._cum = np.asarray(self.cumulative_sizes, dtype=np.int64)
+        self._starts = np.concatenate([[0], self._cum[:-1]])
+        self._real_sizes = np.asarray(self.real_sizes, dtype=np.int64)
+
+        def _concat(get_sizes):
+            return np.concatenate([
+                np.tile(np.asarray(get_sizes(ds)).astype(np.int32, copy=False), sr)
+                for ds, sr in zip(self.datasets, self.sample_ratios)
+            ])
+
+        # LanguagePairDataset-style children: sizes is src_sizes, size() is
+        # (src, tgt) and num_tokens() their max, all read from two arrays
+        self._src_sizes = self._tgt_sizes = None
+        if all(hasattr(ds, 'src_sizes') for ds in self.datasets):
+            self._src_sizes = _concat(lambda ds: ds.src_sizes)
+            self._tgt_sizes = _concat(
+                lambda ds: ds.tgt_sizes if ds.tgt_sizes is not None
+                else np.zeros(len(ds.src_sizes), dtype=np.int32)
+            )
+            self._sizes = self._src_sizes
+        else:
+            self._sizes = _concat(
+                lambda ds: ds.sizes if isinstance(ds.sizes, np.ndarray) else ds.sizes[0]
+            )
+
+    def _get_dataset_and_sample_index(self, idx):
+        if np.ndim(idx) == 0:
+            # bisect on the cumulative list is much cheaper for a single index
+            return super()._get_dataset_and_sample_index(idx)
+        dataset_idx = np.searchsorted(self._cum, idx, side='right')
+        sample_idx = (idx - self._starts[dataset_idx]) % self._real_sizes[dataset_idx]
+        return dataset_idx, sample_idx
+
+    def size(self, idx: int):
+        if self._src_sizes is None:
+            return super().size(idx)
+        return (self._src_sizes[idx], self._tgt_sizes[idx])
+
+    def num_tokens(self, index: int):
+        if self._src_sizes is None:
+            return super().num_tokens(index)
+        return max(self._src_sizes[index], self._tgt_sizes[index])
+
+    @property
+    def sizes(self):
+        return self._sizes
@@ -3,9 +3,9 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import os
 import torch
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
 import json
 import itertools
 import logging
@@ -19,13 +19,12 @@ from fairseq.data import (
     ConcatDataset,
     data_utils,
     encoders,
+    FusedSrcAppendDataset,
     indexed_dataset,
     LanguagePairDataset,
+    MultilingualConcatDataset,
     PrependTokenDataset,
-    StripTokenDataset,
-    TruncateDataset,
     ResamplingDataset,
-    SortDataset
 )
 
 from fairseq.tasks.translation_from_pretrained_bart import TranslationFromPretrainedBARTTask
@@ -35,17 +34,29 @@ logger = logging.getLogger(__name__)
 
 def load_langpair_sumdataset(
     data_path, split,
-    src, src_dict, src_lang,
-    tgt, tgt_dict, tgt_lang,
+    src, src_dict, src_lang_tok,
+    tgt, tgt_dict, tgt_lang_tok,
     combine, dataset_impl, upsample_primary,
     left_pad_source, left_pad_target, max_source_positions,
     max_target_positions, prepend_bos=False, load_alignments=False,
     truncate_source=False, append_source_id=False, trg_prepend=False,
+    load_target=True,
 ):
 
+    # list the directory once instead of stat-ing every candidate shard
+    try:
+        entries = set(os.listdir(data_path))
+    except FileNotFoundError:
+        entries = set()
+
     def split_exists(split, src, tgt, lang, data_path):
-        filename = os.path.join(data_path, '{}.{}-{}.{}'.format(split, src, tgt, lang))
-        return indexed_dataset.dataset_exists(filename, impl=dataset_impl)
+        filename = '{}.{}-{}.{}'.format(split, src, tgt, lang)
+        if dataset_impl == 'raw':
+            return filename in entries
+        return (
+            indexed_dataset.index_file_path(filename) in entries
+            and indexed_dataset.data_file_path(filename) in entries
+        )
 
     src_datasets = []
     tgt_datasets = []
@@ -67,13 +78,14 @@ def load_langpair_sumdataset(
         src_dataset = data_utils.load_indexed_dataset(prefix + src, src_dict, dataset_impl)
         src_datasets.append(src_dataset)
 
-        tgt_dataset = data_utils.load_indexed_dataset(prefix + tgt, tgt_dict, dataset_impl)
-        if tgt_dataset is not None:
-            tgt_datasets.append(tgt_dataset)
+        if load_target:
+            tgt_dataset = data_utils.load_indexed_dataset(prefix + tgt, tgt_dict, dataset_impl)
+            if tgt_dataset is not None:
+                tgt_datasets.append(tgt_dataset)
 
-        logger.info('{} {} {}-{} {} examples'.format(
+        logger.info('%s %s %s-%s %d examples',
             data_path, split_k, src, tgt, len(src_datasets[-1])
-        ))
+        )
 
         if not combine:
             break
@@ -101,22 +113,22 @@ def load_langpair_sumdataset(
     if truncate_source:
         trunc_len = max_source_positions-1 if append_source_id else max_source_positions
         logger.info("Truncate source to max length %d", trunc_len)
-        src_dataset = AppendTokenDataset(
-            TruncateDataset(
-                StripTokenDataset(src_dataset, src_dict.eos()),
-                trunc_len - 1,
-            ),
-            src_dict.eos(),
+        # strip/truncate/append eos and the language tag in one pass
+        src_dataset = FusedSrcAppendDataset(
+            src_dataset, src_dict.eos(),
+            lang_tok=src_lang_tok if append_source_id else None,
+            trunc_len=trunc_len,
         )
+    elif append_source_id:
+        src_dataset = AppendTokenDataset(src_dataset, src_lang_tok)
 
     eos = None
     if append_source_id:
-        src_dataset = AppendTokenDataset(src_dataset, src_dict.index('[{}]'.format(src_lang)))
         if tgt_dataset is not None:
             if trg_prepend:
-                tgt_dataset = PrependTokenDataset(tgt_dataset, tgt_dict.index('[{}]'.format(tgt_lang)))
-            tgt_dataset = AppendTokenDataset(tgt_dataset, tgt_dict.index('[{}]'.format(tgt_lang)))
-        eos = tgt_dict.index('[{}]'.format(tgt_lang))
+                tgt_dataset = PrependTokenDataset(tgt_dataset, tgt_lang_tok)
+            tgt_dataset = AppendTokenDataset(tgt_dataset, tgt_lang_tok)
+        eos = tgt_lang_tok
     
 
     align_dataset = None
@@ -136,6 +148,36 @@ def load_langpair_sumdataset(
         align_dataset=align_dataset, eos=eos
     )
 
+def _load_one_lang(kwargs):
+    return load_langpair_sumdataset(**kwargs)
+
+
+def _find_mmap_datasets(dataset, found):
+    """Collect the MMapIndexedDatasets underneath a tree of wrapper datasets."""
+    if dataset is None or id(dataset) in found:
+        return found
+    if isinstance(dataset, indexed_dataset.MMapIndexedDataset):
+        found[id(dataset)] = dataset
+    elif isinstance(dataset, ConcatDataset):
+        for d in dataset.datasets:
+            _find_mmap_datasets(d, found)
+    elif isinstance(dataset, LanguagePairDataset):
+        _find_mmap_datasets(dataset.src, found)
+        _find_mmap_datasets(dataset.tgt, found)
+    else:
+        _find_mmap_datasets(getattr(dataset, 'dataset', None), found)
+    return found
+
+
+def _prefault_mmap(dataset, page_size=4096):
+    # a strided read touches one byte per page, faulting in the whole mapping;
+    # these are private MMapIndexedDataset attributes, so skip what is missing
+    index = getattr(dataset, '_index', None)
+    for buf in (getattr(index, '_bin_buffer_mmap', None), getattr(dataset, '_bin_buffer_mmap', None)):
+        if buf is not None:
+            buf[::page_size].sum()
+
+
 @register_task('summarization_from_pretrained_mbart_joint')
 class SummarizationFromPretrainedMBARTTaskJoint(TranslationFromPretrainedBARTTask):
     """
@@ -168,6 +210,13 @@ class SummarizationFromPretrainedMBARTTaskJoint(TranslationFromPretrainedBARTTas
         parser.add_argument('--langs-for-sum', required=True, help='language for summary pretrain')
         parser.add_argument('--fix2x', default='', help='one language to other languages')
         parser.add_argument('--trg-prepend', action='store_true', help='fixed decoder during from pretrain')
+        parser.add_argument('--source-only', action='store_true',
+                            help='skip loading summaries for splits other than the train/valid subsets '
+                                 '(inference without references)')
+        parser.add_argument('--prefault-mmap', action='store_true',
+                            help='fault in every page of the mmap shards in the trainer process; '
+                                 'only helps with --num-workers 0, since forked dataloader workers '
+                                 'fault pages in again')
         # fmt: on
 
     def __init__(self, args, src_dict, tgt_dict):
@@ -177,6 +226,16 @@ class SummarizationFromPretrainedMBARTTaskJoint(TranslationFromPretrainedBARTTas
                 src_dict.index('</s>'),src_dict.index('<unk>')
                 )
         self.langs_for_summ = args.langs_for_sum.split(",")
+        # language tag ids as (src_dict id, tgt_dict id), resolved once
+        langs = self.langs_for_summ + ([args.fix2x] if args.fix2x else [])
+        self._lang_tok = {}
+        for lang in langs:
+            tag = '[{}]'.format(lang)
+            self._lang_tok[lang] = (src_dict.index(tag), tgt_dict.index(tag))
+        # inference languages are optional; like Dictionary.index, an unset
+        # --doc-lang/--sum-lang resolves to the unk index
+        self.doc_lang_id = src_dict.index('[{}]'.format(getattr(args, 'doc_lang', None)))
+        self.sum_lang_id = tgt_dict.index('[{}]'.format(getattr(args, 'sum_lang', None)))
         
 
     def load_dataset(self, split, epoch=1, combine=False, **kwargs):
@@ -192,20 +251,27 @@ class SummarizationFromPretrainedMBARTTaskJoint(TranslationFromPretrainedBARTTas
         # src="doc", tgt="sum"
         src, tgt = self.args.source_lang, self.args.target_lang
 
-        lang_datasets= []
+        # training and validation always need summaries for the criterion
+        load_target = (
+            not getattr(self.args, 'source_only', False)
+            or split == getattr(self.args, 'train_subset', 'train')
+            or split in getattr(self.args, 'valid_subset', '').split(',')
+        )
+
         languages = self.langs_for_summ
+        tasks = []
         for lang in languages:
             code = lang.split('_')[0]   # en_XX -> en
             lang_path = os.path.join(data_path, code)
-            logger.info("load lang {} from {}".format(lang, lang_path))
+            logger.info("load lang %s from %s", lang, lang_path)
             if self.args.fix2x != '':
                 srclang = self.args.fix2x
             else:
                 srclang = lang
-            lang_dataset = load_langpair_sumdataset(
-                lang_path, split, 
-                src, self.src_dict, srclang,
-                tgt, self.tgt_dict, lang,
+            tasks.append(dict(
+                data_path=lang_path, split=split,
+                src=src, src_dict=self.src_dict, src_lang_tok=self._lang_tok[srclang][0],
+                tgt=tgt, tgt_dict=self.tgt_dict, tgt_lang_tok=self._lang_tok[lang][1],
                 combine=combine, dataset_impl=self.args.dataset_impl,
                 upsample_primary=self.args.upsample_primary,
                 left_pad_source=self.args.left_pad_source,
@@ -216,21 +282,35 @@ class SummarizationFromPretrainedMBARTTaskJoint(TranslationFromPretrainedBARTTas
                 load_alignments=self.args.load_alignments,
                 prepend_bos=getattr(self.args, 'preprend_bos', False),
                 append_source_id=True, trg_prepend=getattr(self.args, 'trg_prepend', False),
-                )
-            lang_datasets.append(lang_dataset)
-            # print(lang_dataset[0])
+                load_target=load_target,
+            ))
 
-        dataset_lengths = np.array(
-            [len(d) for d in lang_datasets],
-            dtype=float,
+        # shard discovery and index reads are IO bound, so overlap them across
+        # languages; ex.map keeps the results in language order
+        with ThreadPoolExecutor(max_workers=min(len(tasks), os.cpu_count() or 1)) as ex:
+            lang_datasets = list(ex.map(_load_one_lang, tasks))
+
+        dataset_lengths = np.fromiter(
+            (len(d) for d in lang_datasets),
+            dtype=np.float64, count=len(lang_datasets),
         )
         logger.info(
-            'Loaded total {} examples for all languages'.format(
-                dataset_lengths.sum(),
-            )
+            'Loaded total %d examples for all languages',
+            dataset_lengths.sum(),
         )
 
-        dataset = ConcatDataset(lang_datasets)
+        dataset = MultilingualConcatDataset(lang_datasets)
+        if getattr(self.args, 'prefault_mmap', False):
+            mmap_datasets = list(_find_mmap_datasets(dataset, {}).values())
+            if getattr(self.args, 'num_workers', 0) > 0:
+                logger.warning(
+                    "--prefault-mmap only maps pages in the main process; "
+                    "dataloader workers (--num-workers %d) still fault them in",
+                    self.args.num_workers,
+                )
+            logger.info("prefault %d mmap shards", len(mmap_datasets))
+            with ThreadPoolExecutor(max_workers=8) as ex:
+                list(ex.map(_prefault_mmap, mmap_datasets))
         lang_splits = [split]
         for lang_id, lang_dataset in enumerate(lang_datasets):
             split_name = split + '_' + languages[lang_id]
@@ -242,19 +322,7 @@ class SummarizationFromPretrainedMBARTTaskJoint(TranslationFromPretrainedBARTTas
                 split, ','.join(lang_splits)
             )
 
-        with data_utils.numpy_seed(self.args.seed + epoch):
-            shuffle = np.random.permutation(len(dataset))
-
-        self.datasets[split] = SortDataset(
-            dataset,
-            sort_order=[
-                shuffle,
-                dataset.sizes,
-            ],
-        )
-
         self.datasets[split] = dataset
-        print(self.datasets[split][0])
 
     def build_model(self, args):
         model = super().build_model(args)
@@ -267,7 +335,7 @@ class SummarizationFromPretrainedMBARTTaskJoint(TranslationFromPretrainedBARTTas
             from fairseq.sequence_scorer import SequenceScorer
             return SequenceScorer(
                 self.target_dictionary,
-                eos=self.tgt_dict.index('[{}]'.format(self.args.sum_lang))
+                eos=self.sum_lang_id
             )
         else:
             from fairseq.sequence_generator import SequenceGenerator
@@ -284,15 +352,17 @@ class SummarizationFromPretrainedMBARTTaskJoint(TranslationFromPretrainedBARTTas
                 temperature=getattr(args, 'temperature', 1.),
                 match_source_len=getattr(args, 'match_source_len', False),
                 no_repeat_ngram_size=getattr(args, 'no_repeat_ngram_size', 0),
-                eos=self.tgt_dict.index('[{}]'.format(self.args.sum_lang))  # eos: beginning of sentence token
+                eos=self.sum_lang_id  # eos: beginning of sentence token
             )
 
     def build_dataset_for_inference(self, src_tokens, src_lengths):
-        src_lang_id = self.source_dictionary.index('[{}]'.format(self.args.doc_lang))
+        src_lang_id = self.doc_lang_id
         source_tokens = []
-        for s_t in src_tokens:
-            s_t = torch.cat([s_t, s_t.new(1).fill_(src_lang_id)])
-            source_tokens.append(s_t)
+        if len(src_tokens) > 0:
+            # one shared tail tensor; torch.cat copies it into each example
+            lang_tok = src_tokens[0].new_tensor([src_lang_id])
+            source_tokens = [torch.cat((s_t, lang_tok)) for s_t in src_tokens]
+        src_lengths = np.array(src_lengths) + 1
         dataset = LanguagePairDataset(source_tokens, src_lengths, self.source_dictionary)
         return dataset
 
@@ -301,8 +371,7 @@ class SummarizationFromPretrainedMBARTTaskJoint(TranslationFromPretrainedBARTTas
         Get smoothed sampling porbability by languages. This helps low resource
         languages by upsampling them.
         """
-        prob = dataset_lens / dataset_lens.sum()
-        # smoothed_prob = prob ** self.args.multilang_sampling_alpha
-        smoothed_prob = prob ** 1.0 # self.args.multilang_sampling_alpha=1.0
-        smoothed_prob = smoothed_prob / smoothed_prob.sum()
-        return smoothed_prob
+        # multilang_sampling_alpha is fixed to 1.0, so smoothing is the identity
+        prob = dataset_lens.astype(np.float64)
+        prob /= prob.sum()
+        return prob